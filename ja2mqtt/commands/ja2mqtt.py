@@ -17,16 +17,20 @@ from ja2mqtt.commands.query import command_publish, command_states
 from ja2mqtt.utils import bcolors, format_str_color
 
 
+def install_signal_handlers():
+    """
+    Set the global exit event when the process receives SIGTERM, SIGHUP or SIGINT.
+    """
+    for sig in (signal.SIGTERM, signal.SIGHUP, signal.SIGINT):
+        signal.signal(sig, lambda x, y: ja2mqtt_config.exit_event.set())
+
+
 class CoreCommand(click.core.Group):
     def invoke(self, ctx):
         ja2mqtt_config.ANSI_COLORS = not ctx.params.get("no-ansi", False)
         ja2mqtt_config.DEBUG = ctx.params.get("debug", False)
         try:
-            for sig in ("TERM", "HUP", "INT"):
-                signal.signal(
-                    getattr(signal, "SIG" + sig),
-                    lambda x, y: ja2mqtt_config.exit_event.set(),
-                )
+            install_signal_handlers()
             click.core.Group.invoke(self, ctx)
         except click.exceptions.Exit as e:
             sys.exit(int(str(e)))
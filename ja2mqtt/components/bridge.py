@@ -3,21 +3,24 @@
 
 from __future__ import absolute_import, unicode_literals
 
-import json
 import logging
 import re
 import threading
 import time
-from queue import Empty, Queue
-
-import paho.mqtt.client as mqtt
+from collections import deque
+from functools import lru_cache
+from heapq import merge
+from queue import Empty
 
 from ja2mqtt.config import Config
 from ja2mqtt.utils import (
     Map,
     PythonExpression,
     deep_eval,
+    deep_has_eval,
     deep_merge,
+    json_dumps,
+    json_loads,
     merge_dicts,
     randomString,
 )
@@ -27,6 +30,19 @@ from .serial import SerialJA121TException, decode_prfstate
 
 PRFSTATE_RE = re.compile("PRFSTATE ([0-9A-F]+)")
 
+# back references and conditional group references depend on group numbers that
+# change when patterns are combined
+BACKREF_RE = re.compile(r"\\[1-9]|\(\?P=|\(\?\(")
+
+
+@lru_cache(maxsize=256)
+def compile_pattern(pattern):
+    """
+    Compile the regular expression `pattern`. The compiled objects are cached so that
+    rules creating the same patterns in the scope do not compile them repeatedly.
+    """
+    return re.compile(pattern)
+
 
 class Pattern:
     """
@@ -36,10 +52,12 @@ class Pattern:
     for the `wrtie` condition of the rule.
     """
 
+    __slots__ = ("match", "pattern", "re")
+
     def __init__(self, pattern):
         self.match = None
         self.pattern = pattern
-        self.re = re.compile(self.pattern)
+        self.re = compile_pattern(self.pattern)
 
     def __str__(self):
         return f"r'{self.pattern}'" if self.match is None else self.match.group(0)
@@ -97,7 +115,7 @@ class PrfStateChange:
 
 class SectionState:
     def __init__(self, pattern, section_group=1, state_group=2):
-        self.re = re.compile(pattern)
+        self.re = compile_pattern(pattern)
         self.section_group = section_group
         self.state_group = state_group
         self.state = None
@@ -138,6 +156,8 @@ class PrfState:
 
 
 class Topic:
+    __slots__ = ("name", "disabled", "rules", "read_checks")
+
     def __init__(self, prefix, topic):
         if topic["name"].startswith(prefix):
             self.name = topic["name"]
@@ -148,33 +168,46 @@ class Topic:
             self.name = prefix + sep + topic["name"]
         self.disabled = topic.get("disabled", False)
         self.rules = []
+        # precompiled checks of rules' reads, the list is parallel to rules
+        self.read_checks = []
         for rule_def in topic["rules"]:
-            self.rules.append(Map(rule_def))
+            rule = Map(rule_def)
+            self.rules.append(rule)
+            self.read_checks.append(
+                self.compile_read(rule.read) if isinstance(rule.read, dict) else None
+            )
 
-    def check_rule_data(self, read, data, scope, path=None):
-        if path is None:
-            path = []
+    @classmethod
+    def compile_read(cls, read):
+        """
+        Return the rule's `read` definition as a list of `(key, value, is_expr)` checks,
+        where `is_expr` is True when the value is a Python expression.
+        """
+        return [(k, v, isinstance(v, PythonExpression)) for k, v in read.items()]
+
+    def check_rule_data(self, read, data, scope, checks=None):
+        """
+        Check the data against the rule's `read` definition. The `checks` are the
+        precompiled `read` from `read_checks`, they are compiled when not provided.
+        """
+        if checks is None:
+            checks = self.compile_read(read)
         try:
-            for k, v in read.items():
-                path += [k]
+            for k, v, is_expr in checks:
                 if k not in data.keys():
                     raise Exception(f"Missing property {k}.")
-                else:
-                    if not isinstance(v, PythonExpression) and type(v) != type(data[k]):
-                        raise Exception(
-                            f"Invalid type of property {'.'.join(path)}, "
-                            + f"found: {type(data[k]).__name__}, expected: {type(v).__name__}"
-                        )
-                    if type(v) == dict:
-                        self.check_rule_data(v, data[k], scope, path)
-                    else:
-                        if isinstance(v, PythonExpression):
-                            v = v.eval(scope)
-                        if v != data[k]:
-                            raise Exception(
-                                f"Invalid value of property {'.'.join(path)}, "
-                                + f"found: {data[k]}, exepcted: {v}"
-                            )
+                if not is_expr and type(v) != type(data[k]):
+                    raise Exception(
+                        f"Invalid type of property {k}, "
+                        + f"found: {type(data[k]).__name__}, expected: {type(v).__name__}"
+                    )
+                if is_expr:
+                    v = v.eval(scope)
+                if v != data[k]:
+                    raise Exception(
+                        f"Invalid value of property {k}, "
+                        + f"found: {data[k]}, exepcted: {v}"
+                    )
         except Exception as e:
             raise Exception(f"Topic data validation failed. {str(e)}")
 
@@ -197,6 +230,7 @@ class JA2MQTTConfig:
             scope=self.scope(),
             use_template=True,
             schema="ja2mqtt-schema.yaml",
+            cache_depends=[config.config_file, config.env_file],
         )
 
         # system properties
@@ -212,6 +246,12 @@ class JA2MQTTConfig:
         for topic_def in self.ja2mqtt("mqtt2serial"):
             self.topics_mqtt2serial.append(Topic(self.topic_prefix, topic_def))
 
+        # mqtt2serial topics by their names for lookups of incoming events, topic names
+        # do not have to be unique
+        self.mqtt2serial_by_name = {}
+        for topic in self.topics_mqtt2serial:
+            self.mqtt2serial_by_name.setdefault(topic.name, []).append(topic)
+
     def scope(self):
         section_states = {}
 
@@ -249,7 +289,7 @@ class JA2MQTTConfig:
         return corrid_field, corr_id if corrid_field is not None else None
 
     def topic_exists(self, name):
-        return name in [x.name for x in self.topics_mqtt2serial]
+        return name in self.mqtt2serial_by_name
 
 
 class SerialMQTTBridge(Component, JA2MQTTConfig):
@@ -259,7 +299,10 @@ class SerialMQTTBridge(Component, JA2MQTTConfig):
         self.mqtt = None
         self.serial = None
         self._scope = None
-        self.request_queue = Queue()
+        self._scope_gen = 0
+        self._read_cache = {}
+        self._regex_prefilter = None
+        self.request_queue = deque()
         self.request = None
 
         self.log.info(f"The ja2mqtt definition file is {self.ja2mqtt_file}")
@@ -274,12 +317,33 @@ class SerialMQTTBridge(Component, JA2MQTTConfig):
             f"The mqtt2serial topics are: {Topic.list(self.topics_mqtt2serial)}"
         )
 
+        # serial2mqtt rules with string reads indexed by the string, the remaining rules
+        # must be evaluated for every serial data; the items keep the order of rules
+        self._literal_reads = {}
+        self._dynamic_reads = []
+        # serialized writes of rules without python expressions and correlation
+        self._static_writes = {}
+        order = 0
+        for topic in self.topics_serial2mqtt:
+            for rule in topic.rules:
+                if rule.no_correlation and not deep_has_eval(rule.write):
+                    self._static_writes[id(rule)] = json_dumps(rule.write)
+                if isinstance(rule.read, str):
+                    self._literal_reads.setdefault(rule.read, []).append(
+                        (order, topic, rule)
+                    )
+                else:
+                    self._dynamic_reads.append((order, topic, rule))
+                order += 1
+
         # states of perihperals
         self.prfstate = [decode_prfstate("".zfill(self.prfstate_bits))]
 
     def update_correlation(self, data):
-        if self.request_queue.qsize() > 0:
-            self.request = self.request_queue.get()
+        try:
+            self.request = self.request_queue.popleft()
+        except IndexError:
+            pass
         if self.request is not None:
             if (
                 time.time() - self.request.created_time < self.correlation_timeout
@@ -299,6 +363,10 @@ class SerialMQTTBridge(Component, JA2MQTTConfig):
     def update_scope(self, key, value=None, remove=False):
         if self._scope is None:
             self.scope()
+        # `data` is only set while a matched rule is processed and rule reads are
+        # evaluated before it is set, so it does not invalidate cached reads
+        if key != "data":
+            self._scope_gen += 1
         if not remove:
             self._scope[key] = value
         else:
@@ -316,6 +384,65 @@ class SerialMQTTBridge(Component, JA2MQTTConfig):
         except SerialJA121TException as e:
             self.log.error({str(e)})
 
+    def eval_read(self, rule):
+        """
+        Return the value of the rule's `read` property. The Python expressions are evaluated
+        only once for every generation of the scope and the results are cached, i.e. the
+        matcher objects such as `Pattern`, `PrfState` or `SectionState` are reused for all
+        the serial data until the scope changes.
+        """
+        if not isinstance(rule.read, PythonExpression):
+            return rule.read
+        cached = self._read_cache.get(id(rule))
+        if cached is not None and cached[0] == self._scope_gen:
+            return cached[1]
+        value = rule.read.eval(self.scope())
+        self._read_cache[id(rule)] = (self._scope_gen, value)
+        return value
+
+    def regex_prefilter(self):
+        """
+        Return a tuple `(regex, orders)` where `regex` combines the regular expressions of
+        serial2mqtt rules whose reads evaluate to `Pattern` or `SectionState` into a single
+        alternation with a group `r<i>` for the i-th rule in `orders`. The `regex` is None
+        when there are no such rules or the expressions cannot be combined.
+        """
+        if self._regex_prefilter is None or self._regex_prefilter[0] != self._scope_gen:
+            orders = []
+            patterns = []
+            for order, topic, rule in self._dynamic_reads:
+                value = self.eval_read(rule)
+                if isinstance(value, (Pattern, SectionState)) and not BACKREF_RE.search(
+                    value.re.pattern
+                ):
+                    patterns.append(f"(?P<r{len(orders)}>{value.re.pattern})")
+                    orders.append(order)
+            try:
+                regex = re.compile("|".join(patterns)) if patterns else None
+            except re.error:
+                regex = None
+            self._regex_prefilter = (self._scope_gen, regex, orders)
+        return self._regex_prefilter[1:]
+
+    def serial2mqtt_rules(self, data):
+        """
+        Return `(order, topic, rule)` items of serial2mqtt rules that can match the serial
+        data in the order they are defined. Rules with string reads are only included
+        when the string is equal to the data. Rules with regular expressions are matched
+        at once by the `regex_prefilter` and only included from the first rule that matches.
+        """
+        items = self._dynamic_reads
+        regex, orders = self.regex_prefilter()
+        if regex is not None:
+            m = regex.match(data)
+            skip = set(orders if m is None else orders[: int(m.lastgroup[1:])])
+            if skip:
+                items = [x for x in items if x[0] not in skip]
+        literal_reads = self._literal_reads.get(data)
+        if literal_reads is None:
+            return items
+        return merge(literal_reads, items)
+
     def on_mqtt_connect(self, client, userdata, flags, rc):
         for topic in self.topics_mqtt2serial:
             self.mqtt.subscribe(topic.name)
@@ -327,35 +454,33 @@ class SerialMQTTBridge(Component, JA2MQTTConfig):
             )
             return
         try:
-            data = Map(json.loads(payload))
+            data = Map(json_loads(payload))
         except Exception as e:
             raise Exception(f"Cannot parse the event data. {str(e)}")
 
         self.log.debug(f"The event data parsed as JSON object: {data}")
-        for topic in self.topics_mqtt2serial:
-            if topic.name == topic_name:
-                if topic.disabled:
-                    continue
-                for rule in topic.rules:
-                    if rule.read is not None:
-                        topic.check_rule_data(rule.read, data, self.scope())
-                        self.log.debug(
-                            "The event data is valid according to the defined rules."
-                        )
-                    _data = Map(data)
-                    self.update_scope("data", _data)
-                    try:
-                        s = deep_eval(rule.write, self._scope)
-                        self.request_queue.put(
-                            Map(
-                                cor_id=_data.get(self.correlation_id),
-                                created_time=time.time(),
-                                ttl=rule.get("request_ttl", 1),
-                            )
+        for topic in self.mqtt2serial_by_name.get(topic_name, []):
+            if topic.disabled:
+                continue
+            for rule, checks in zip(topic.rules, topic.read_checks):
+                if rule.read is not None:
+                    topic.check_rule_data(rule.read, data, self.scope(), checks)
+                    self.log.debug(
+                        "The event data is valid according to the defined rules."
+                    )
+                self.update_scope("data", data)
+                try:
+                    s = deep_eval(rule.write, self._scope)
+                    self.request_queue.append(
+                        Map(
+                            cor_id=data.get(self.correlation_id),
+                            created_time=time.time(),
+                            ttl=rule.get("request_ttl", 1),
                         )
-                        self.serial.writeline(s)
-                    finally:
-                        self.update_scope("data", remove=True)
+                    )
+                    self.serial.writeline(s)
+                finally:
+                    self.update_scope("data", remove=True)
 
     def on_serial_data(self, data):
         if not self.mqtt.connected:
@@ -366,32 +491,32 @@ class SerialMQTTBridge(Component, JA2MQTTConfig):
 
         self.update_prfstate(data)
         _rule = None
-        current_time = time.time()
-        for topic in self.topics_serial2mqtt:
-            for rule in topic.rules:
-                if isinstance(rule.read, PythonExpression):
-                    _data = rule.read.eval(self.scope())
-                else:
-                    _data = rule.read
-                if _data == data:
-                    _rule = rule
-                    if not topic.disabled:
-                        self.update_scope("data", _data)
-                        try:
-                            d0 = self.update_correlation(Map())
-                            if not rule.require_request or self.request is not None:
+        _topic = None
+        for _, topic, rule in self.serial2mqtt_rules(data):
+            if topic is not _topic:
+                if _rule is not None and not _rule.process_next_rule:
+                    break
+                _topic = topic
+            _data = self.eval_read(rule)
+            if _data == data:
+                _rule = rule
+                if not topic.disabled:
+                    self.update_scope("data", _data)
+                    try:
+                        d0 = self.update_correlation(Map())
+                        if not rule.require_request or self.request is not None:
+                            write_data = self._static_writes.get(id(rule))
+                            if write_data is None:
                                 if rule.no_correlation:
                                     d0 = {}
                                 d1 = deep_merge(rule.write, d0)
                                 d2 = deep_eval(d1, self._scope)
-                                write_data = json.dumps(d2)
-                                self.mqtt.publish(topic.name, write_data)
-                                if not _rule.process_next_rule:
-                                    break
-                        finally:
-                            self.update_scope("data", remove=True)
-            if _rule is not None and not _rule.process_next_rule:
-                break
+                                write_data = json_dumps(d2)
+                            self.mqtt.publish(topic.name, write_data)
+                            if not _rule.process_next_rule:
+                                break
+                    finally:
+                        self.update_scope("data", remove=True)
 
         if _rule is None:
             self.log.debug(f"No rule found for the data: {data}")
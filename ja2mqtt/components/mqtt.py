@@ -10,14 +10,10 @@ import threading
 import time
 from queue import Queue
 
-import paho.mqtt.client as mqtt
-import serial as py_serial
-
 from ja2mqtt.config import Config
 from ja2mqtt.utils import Map, PythonExpression, deep_eval, deep_merge, merge_dicts
 
 from . import Component
-from .simulator import Simulator
 
 
 class MQTT(Component):
@@ -32,18 +28,14 @@ class MQTT(Component):
         self.port = self.config.value_int("port", default=1883)
         self.keepalive = self.config.value_int("keepalive", default=60)
         self.reconnect_after = self.config.value_int("reconnect_after", default=30)
-        self.loop_timeout = self.config.value_int("loop_timeout", default=1)
         self.username = self.config.value_str("username", default=None)
         self.password = self.config.value_str("password", default=None)
-        self.protocol = {
-            "MQTTv311": mqtt.MQTTv311,
-            "MQTTv31": mqtt.MQTTv31,
-            "default": None,
-        }[self.config.value_str("protocol", default="MQTTv311")]
+        self.protocol = self.config.value_str("protocol", default="MQTTv311")
         self.transport = self.config.value_str("transport", default="tcp")
         self.clean_session = self.config.value_str("clean_session", default=None)
         self.client = None
         self.connected = False
+        self.connected_event = threading.Event()
         self.on_connect_ext = None
         self.on_message_ext = None
         self.on_error_ext = None
@@ -53,7 +45,7 @@ class MQTT(Component):
     def __str__(self):
         return (
             f"{self.__class__}: name={self.name}, address={self.address}, port={self.port}, keepalive={self.keepalive}, "
-            + f"reconnect_after={self.reconnect_after}, loop_timeout={self.loop_timeout}, connected={self.connected}"
+            + f"reconnect_after={self.reconnect_after}, connected={self.connected}"
         )
 
     def on_error(self, exception):
@@ -62,8 +54,8 @@ class MQTT(Component):
             self.on_error_ext(exception)
 
     def on_message(self, client, userdata, message):
-        topic_name = message._topic.decode("utf-8")
-        payload = str(message.payload.decode("utf-8"))
+        topic_name = message.topic
+        payload = message.payload.decode("utf-8")
         self.log.info(f"--> recv: {topic_name}, payload={payload}")
         if self.on_message_ext is not None:
             try:
@@ -73,6 +65,7 @@ class MQTT(Component):
 
     def on_connect(self, client, userdata, flags, rc):
         self.connected = True
+        self.connected_event.set()
         self.client.on_message = self.on_message
         self.log.info(f"Connected to the MQTT broker at {self.address}:{self.port}")
         if self.on_connect_ext is not None:
@@ -85,16 +78,23 @@ class MQTT(Component):
         try:
             self.log.info(f"Disconnected from the MQTT broker.")
             self.connected = False
+            self.connected_event.clear()
             if rc != 0:
                 raise Exception("The client was disconnected unexpectedly.")
         except Exception as e:
             self.on_error(e)
 
     def init_client(self):
+        import paho.mqtt.client as mqtt
+
         self.client = mqtt.Client(
             self.client_name,
             clean_session=self.clean_session,
-            protocol=self.protocol,
+            protocol={
+                "MQTTv311": mqtt.MQTTv311,
+                "MQTTv31": mqtt.MQTTv31,
+                "default": None,
+            }[self.protocol],
             transport=self.transport,
         )
         if self.username is not None:
@@ -120,6 +120,7 @@ class MQTT(Component):
             if self.client is not None:
                 self.client.disconnect()
                 self.connected = False
+                self.connected_event.clear()
             self.init_client()
             while not exit_event.is_set():
                 try:
@@ -137,33 +138,34 @@ class MQTT(Component):
                     exit_event.wait(self.reconnect_after)
 
     def wait_is_connected(self, exit_event, timeout=0):
-        start_time = time.time()
-        while (
-            not exit_event.is_set()
-            and not self.connected
-            and (timeout == 0 or time.time() - start_time <= timeout)
-        ):
-            exit_event.wait(0.2)
+        """
+        Wait until the client is connected to the MQTT broker, the `exit_event` is set or
+        the `timeout` expires (0 means no timeout). The wait ends as soon as the connection
+        is established, the `exit_event` is checked at least once every second.
+        """
+        end_time = time.time() + timeout if timeout > 0 else None
+        while not exit_event.is_set():
+            wait_time = 1 if end_time is None else min(1, end_time - time.time())
+            if wait_time < 0 or self.connected_event.wait(wait_time):
+                break
         return self.connected
 
     def worker(self, exit_event):
+        """
+        Connect to the MQTT broker and run the paho network loop in its own thread until
+        the `exit_event` is set. When the connection is lost, the network loop reconnects
+        with a delay of up to `reconnect_after` seconds.
+        """
         self.__wait_for_connection(exit_event)
         try:
-            while not exit_event.is_set():
-                try:
-                    self.client.loop(timeout=self.loop_timeout, max_packets=1)
-                    if not self.connected:
-                        raise Exception("Not connected to MQTT broker.")
-                except Exception as e:
-                    self.on_error(
-                        Exception(
-                            f"Error occurred in the MQTT loop. {str(e)}"
-                            + f"Will attemmpt to reconnect after {self.reconnect_after} seconds."
-                        )
-                    )
-                    exit_event.wait(self.reconnect_after)
-                    self.__wait_for_connection(exit_event, reconnect=True)
+            if not exit_event.is_set():
+                self.client.reconnect_delay_set(
+                    min_delay=1, max_delay=self.reconnect_after
+                )
+                self.client.loop_start()
+                exit_event.wait()
         finally:
             if self.connected:
                 self.client.disconnect()
+            self.client.loop_stop()
             self.log.info("MQTT worker ended.")
@@ -7,24 +7,28 @@ import json
 import logging
 import os
 import re
+import select
 import threading
 import time
+from collections import namedtuple
 from queue import Queue
 
-import paho.mqtt.client as mqtt
-import serial as py_serial
-
 from ja2mqtt.config import Config, ENCODING
 from ja2mqtt.utils import Map, PythonExpression, deep_eval, deep_merge, merge_dicts
 
 from . import Component
-from .simulator import Simulator
 
 
 class SerialJA121TException(Exception):
     pass
 
 
+SerialSettings = namedtuple(
+    "SerialSettings",
+    ["baudrate", "bytesize", "parity", "stopbits", "rtscts", "xonxoff"],
+)
+
+
 def decode_prfstate(prfstate):
     """
     Decode prfstate from a hexadecimal string to a dictionary, where the keys
@@ -91,9 +95,21 @@ class Serial(Component):
             "minimum_write_delay", default=1
         )
         self.last_write_time = None
+        self.read_buffer = b""
+        self.wakeup_pipe = None
+        self.wakeup_lock = threading.Lock()
+        self.exit_event = None
         if not self.use_simulator:
             self.ser = None
             self.port = self.config.value_str("port", required=True)
+            self.settings = SerialSettings(
+                baudrate=self.config.value_int("baudrate", min=0, default=9600),
+                bytesize=self.config.value_int("bytesize", min=7, max=8, default=8),
+                parity=self.config.value_str("parity", default="N"),
+                stopbits=self.config.value_int("stopbits", default=1),
+                rtscts=self.config.value_bool("rtscts", default=False),
+                xonxoff=self.config.value_bool("xonxoff", default=False),
+            )
             self.log.info(f"The serial connection configured, the port is {self.port}")
         else:
             self.port = "<simulator>"
@@ -103,15 +119,17 @@ class Serial(Component):
 
     def create_serial(self):
         """
-        Create serial object and initialize the parameters from the configuration.
+        Create serial object and initialize the parameters from the serial settings.
         """
+        import serial as py_serial
+
         self.ser = py_serial.serial_for_url(self.port, do_not_open=True)
-        self.ser.baudrate = self.config.value_int("baudrate", min=0, default=9600)
-        self.ser.bytesize = self.config.value_int("bytesize", min=7, max=8, default=8)
-        self.ser.parity = self.config.value_str("parity", default="N")
-        self.ser.stopbits = self.config.value_int("stopbits", default=1)
-        self.ser.rtscts = self.config.value_bool("rtscts", default=False)
-        self.ser.xonxoff = self.config.value_bool("xonxoff", default=False)
+        self.ser.baudrate = self.settings.baudrate
+        self.ser.bytesize = self.settings.bytesize
+        self.ser.parity = self.settings.parity
+        self.ser.stopbits = self.settings.stopbits
+        self.ser.rtscts = self.settings.rtscts
+        self.ser.xonxoff = self.settings.xonxoff
         self.ser.timeout = 1
         self.log.debug(f"The serial object created: {self.ser}")
 
@@ -180,6 +198,62 @@ class Serial(Component):
         except Exception as e:
             self.log.error(str(e))
 
+    def wakeup(self):
+        """
+        Wake up the worker waiting for data from the serial port, e.g. when the exit
+        event was set.
+        """
+        with self.wakeup_lock:
+            if self.wakeup_pipe is not None:
+                os.write(self.wakeup_pipe[1], b"x")
+
+    def open_wakeup_pipe(self):
+        """
+        Create the pipe that `wakeup` uses to wake up the worker. The pipe is only used
+        with a real serial port.
+        """
+        if not self.use_simulator:
+            with self.wakeup_lock:
+                self.wakeup_pipe = os.pipe()
+
+    def close_wakeup_pipe(self):
+        """
+        Close the pipe created by `open_wakeup_pipe`.
+        """
+        with self.wakeup_lock:
+            if self.wakeup_pipe is not None:
+                for fd in self.wakeup_pipe:
+                    os.close(fd)
+                self.wakeup_pipe = None
+
+    def readlines(self):
+        """
+        Read lines from the serial port. When the serial port provides a file descriptor,
+        it waits until data are available or the worker is woken up by `wakeup`, and
+        returns all complete lines read so far. Otherwise (e.g. for the simulator), it
+        returns a single line read with a timeout.
+        """
+        try:
+            fd = self.ser.fileno()
+        except Exception:
+            fd = None
+        if fd is None or self.wakeup_pipe is None:
+            return [self.ser.readline()]
+
+        ready, _, _ = select.select([fd, self.wakeup_pipe[0]], [], [])
+        if self.wakeup_pipe[0] in ready:
+            os.read(self.wakeup_pipe[0], 1024)
+        if fd not in ready:
+            return []
+        data = os.read(fd, 4096)
+        if not data:
+            raise SerialJA121TException(
+                "The device reports readiness to read but returned no data."
+            )
+        lines = (self.read_buffer + data).split(b"\n")
+        self.read_buffer = lines.pop()
+        return lines
+
     def worker(self, exit_event):
         """
         The main worker of the serial object that reads data from the serial port and
@@ -187,31 +261,32 @@ class Serial(Component):
         the data from the serial port) can run in parallel with the `writeline` method,
         due to the "global interpreter lock" they both should be thread-safe.
         """
+        self.open_wakeup_pipe()
         self.open(exit_event)
         try:
             while not exit_event.is_set():
                 try:
-                    x = self.ser.readline()
+                    lines = self.readlines()
                 except Exception as e:
                     self.log.error(
                         f"Error occured while reading data from the serial port. {str(e)}"
                     )
+                    self.read_buffer = b""
                     self.close()
                     self.open(exit_event)
                     continue
-                try:
-                    data_str = x.decode(ENCODING).strip("\r\n").strip()
-                    if data_str != "":
-                        self.log.debug(f"Received data from serial: {data_str}")
-                        self.buffer.put(data_str)
-                except UnicodeDecodeError as e:
-                    self.log.error(str(e))
-                    continue
-                else:
-                    # this is necessary to allow other threads to run too
-                    exit_event.wait(0.2)
+                for x in lines:
+                    try:
+                        data_str = x.decode(ENCODING).strip("\r\n").strip()
+                        if data_str != "":
+                            self.log.debug(f"Received data from serial: {data_str}")
+                            self.buffer.put(data_str)
+                    except UnicodeDecodeError as e:
+                        self.log.error(str(e))
         finally:
             self.close()
+            self.close_wakeup_pipe()
+            self.read_buffer = b""
             self.log.info("Serial worker ended.")
 
     def start(self, exit_event):
@@ -219,14 +294,19 @@ class Serial(Component):
         Start the worker thread of the serial object. If the simulator is used, this also starts
         the worker thread of the simulator object.
         """
+        self.exit_event = exit_event
         super().start(exit_event)
-        if self.use_simulator and isinstance(self.ser, Simulator):
+        if self.use_simulator and self.ser is not None:
             self.ser.start(exit_event)
 
     def join(self):
         """
-        Join the worker thread and simulator thread if it exists.
+        Join the worker thread and simulator thread if it exists. The worker waits for data
+        without a timeout, so it is woken up once the exit event is set.
         """
+        if self.exit_event is not None and self.thread is not None:
+            self.exit_event.wait()
+            self.wakeup()
         super().join()
-        if self.use_simulator and isinstance(self.ser, Simulator):
+        if self.use_simulator and self.ser is not None:
             self.ser.join()
@@ -3,13 +3,13 @@
 
 from __future__ import absolute_import, unicode_literals
 
+import heapq
 import json
 import logging
 import random
-import re
 import threading
 import time
-from queue import Empty, Queue
+from collections import deque
 
 from ja2mqtt.utils import Map, PythonExpression, deep_eval, deep_merge, merge_dicts
 
@@ -18,39 +18,93 @@ ERROR_NO_ACCESS = "ERROR: 3 NO_ACCESS"
 
 from ja2mqtt.config import ENCODING
 
+from .serial import encode_prfstate
+
 
 class SimulatorException(Exception):
     pass
 
 
+def parse_command(data_str):
+    """
+    Parse a command written to the simulator. The supported commands are `<pin> SET <code>`,
+    `<pin> UNSET <code>`, `<pin> STATE [<code>]` and `PRFSTATE`. Return a Map with `pin`,
+    `command` and `code` properties or None when the data is not a supported command.
+    """
+    parts = data_str.split(" ")
+    if parts == ["PRFSTATE"]:
+        return Map(pin=None, command="PRFSTATE", code=None)
+    if len(parts) < 2 or len(parts) > 3 or not parts[0].isdigit():
+        return None
+    code = parts[2] if len(parts) == 3 else None
+    if code is not None and not code.isdigit():
+        return None
+    if parts[1] == "STATE" or (parts[1] in ("SET", "UNSET") and code is not None):
+        return Map(pin=parts[0], command=parts[1], code=code)
+    return None
+
+
 class Section:
+    # transitions of the section state as state -> (next state, error)
+    _SET_TABLE = {"ARMED": (None, ERROR_INVALID_VALUE), "READY": ("ARMED", None)}
+    _UNSET_TABLE = {"READY": (None, ERROR_INVALID_VALUE), "ARMED": ("READY", None)}
+
     def __init__(self, data):
         self.code = data.code
         self.state = data.state
+        self._repr_cache = {
+            st: f"STATE {self.code} {st}" for st in ("ARMED", "READY", self.state)
+        }
 
     def __str__(self):
-        return f"STATE {self.code} {self.state}"
+        return self._repr_cache[self.state]
 
     def __repr__(self):
         return self.__str__()
 
+    def _transition(self, table, command):
+        next_state, error = table.get(self.state, (None, None))
+        if error is not None:
+            return error
+        if next_state is None:
+            raise SimulatorException(
+                f"Cannot run command {command}. Invalid state {self.state}."
+            )
+        self.state = next_state
+        return self._repr_cache[next_state]
+
     def set(self):
-        if self.state == "ARMED":
-            return ERROR_INVALID_VALUE
-        if self.state == "READY":
-            self.state = "ARMED"
-            return self.__str__()
-        raise SimulatorException(f"Cannot run command SET. Invalid state {self.state}.")
+        return self._transition(self._SET_TABLE, "SET")
 
     def unset(self):
-        if self.state == "READY":
-            return ERROR_INVALID_VALUE
-        if self.state == "ARMED":
-            self.state = "READY"
-            return self.__str__()
-        raise SimulatorException(
-            f"Cannot run command UNSET. Invalid state {self.state}."
-        )
+        return self._transition(self._UNSET_TABLE, "UNSET")
+
+
+class RuleState:
+    """
+    State of a simulator rule that writes data periodically.
+    """
+
+    __slots__ = (
+        "write",
+        "time_next",
+        "is_expr_write",
+        "is_expr_time_next",
+        "last_write",
+    )
+
+    def __init__(self, rule):
+        self.write = rule.write
+        self.time_next = rule.time_next
+        self.is_expr_write = isinstance(rule.write, PythonExpression)
+        self.is_expr_time_next = isinstance(rule.time_next, PythonExpression)
+        self.last_write = None
+
+    def write_value(self, scope):
+        return self.write.eval(scope) if self.is_expr_write else self.write
+
+    def time_next_value(self, scope):
+        return self.time_next.eval(scope) if self.is_expr_time_next else self.time_next
 
 
 class Simulator:
@@ -60,6 +114,7 @@ class Simulator:
         self.response_delay = config.value_int("response_delay", default=0.5)
         self.prfstate_bits = prfstate_bits
         self.rules = [Map(x) for x in config.value("rules")]
+        self._rule_states = [RuleState(x) for x in self.rules if x.get("time_next")]
         self.sections = {
             str(x["code"]): Section(Map(x)) for x in config.value("sections")
         }
@@ -69,7 +124,10 @@ class Simulator:
         ]
         self.pin = config.value("pin")
         self.timeout = 1
-        self.buffer = Queue()
+        self.buffer = deque()
+        self.buffer_event = threading.Event()
+        self._scope = None
+        self._prf_keys = {}
 
     def __str__(self):
         return (
@@ -84,114 +142,128 @@ class Simulator:
         pass
 
     def generate_prfstate(self, *pos, on_prob=0.5):
-        _pos = self.peripherals
-        if len(pos) > 0:
-            _pos = list(pos)
-        return {str(p): ("ON" if random.random() < on_prob else "OFF") for p in _pos}
-
-    def _add_to_buffer(self, data):
-        time.sleep(self.response_delay)
-        self.buffer.put(data)
+        keys = self._prf_keys.get(pos)
+        if keys is None:
+            keys = [str(p) for p in (pos if len(pos) > 0 else self.peripherals)]
+            self._prf_keys[pos] = keys
+        _rand = random.random
+        return {k: ("ON" if _rand() < on_prob else "OFF") for k in keys}
+
+    def prf_random_states(self, *pos, on_prob=0.5):
+        # the prfstate is encoded directly from a bit mask when positions are valid bits,
+        # the n-th byte of the encoded state holds the states of positions 8n to 8n+7
+        nbytes = self.prfstate_bits // 8
+        positions = pos if len(pos) > 0 else self.peripherals
+        if all(isinstance(p, int) and 0 <= p < nbytes * 8 for p in positions):
+            _rand = random.random
+            mask = 0
+            for p in positions:
+                if _rand() < on_prob:
+                    mask |= 1 << p
+            return "PRFSTATE " + mask.to_bytes(nbytes, "little").hex().upper()
+
+        prf = self.generate_prfstate(*pos, on_prob=on_prob)
+        return "PRFSTATE " + encode_prfstate(prf, self.prfstate_bits)
+
+    def _enqueue(self, *data):
+        self.buffer.extend(data)
+        self.buffer_event.set()
 
     def write(self, data):
-        def _match(pattern, data_str):
-            m = re.compile(pattern).match(data_str)
-            if m:
-                return Map(m.groupdict())
-            else:
-                return None
-
         def _check_pin(command):
             if command.pin != str(self.pin):
-                self._add_to_buffer(ERROR_NO_ACCESS)
+                self._enqueue(ERROR_NO_ACCESS)
                 return False
             return True
 
-        data_str = data.decode(ENCODING).strip("\n")
+        data_str = data.rstrip(b"\r\n").decode(ENCODING)
+        command = parse_command(data_str)
+        if command is None:
+            return
+
+        # the response to a command is delayed once regardless of the number of lines
+        if self.response_delay:
+            time.sleep(self.response_delay)
 
         # SET and UNSET commands
-        command = _match(
-            "^(?P<pin>[0-9]+) (?P<command>SET|UNSET) (?P<code>[0-9]+)$",
-            data_str,
-        )
-        if command is not None and _check_pin(command):
-            section = self.sections.get(command.code)
-            if section is not None:
-                data = {
-                    "SET": lambda _: section.set(),
-                    "UNSET": lambda _: section.unset(),
-                    "N/A": lambda x: (_ for _ in ()).throw(
-                        SimulatorException(f"The command {x} is not implemented.")
-                    ),
-                }.get(command.command, "N/A")(command.command)
-                self._add_to_buffer(data)
-            else:
-                self._add_to_buffer(ERROR_INVALID_VALUE)
+        if command.command in ("SET", "UNSET"):
+            if _check_pin(command):
+                section = self.sections.get(command.code)
+                if section is not None:
+                    if command.command == "SET":
+                        data = section.set()
+                    elif command.command == "UNSET":
+                        data = section.unset()
+                    else:
+                        raise SimulatorException(
+                            f"The command {command.command} is not implemented."
+                        )
+                    self._enqueue(data)
+                else:
+                    self._enqueue(ERROR_INVALID_VALUE)
             return
 
         # STATE command
-        command = _match(
-            "^(?P<pin>[0-9]+) (?P<command>STATE)( (?P<code>[0-9]+))?$", data_str
-        )
-        if command is not None and _check_pin(command):
-            sections = [
-                x
-                for x in self.sections.values()
-                if command.code is None or str(x.code) == str(command.code)
-            ]
-            time.sleep(self.response_delay)
-            for section in sections:
-                self.buffer.put(str(section))
+        if command.command == "STATE":
+            if _check_pin(command):
+                if command.code is None:
+                    sections = self.sections.values()
+                else:
+                    section = self.sections.get(command.code)
+                    sections = (section,) if section is not None else ()
+                self._enqueue(*[str(x) for x in sections])
             return
 
         # PRFSTATE command
-        command = _match("^(?P<command>PRFSTATE)$", data_str)
-        if command is not None:
-            from .serial import encode_prfstate
-
-            self._add_to_buffer(
+        if command.command == "PRFSTATE":
+            self._enqueue(
                 "PRFSTATE " + encode_prfstate(self.generate_prfstate(on_prob=0.5))
             )
             return
 
     def readline(self):
+        if not self.buffer:
+            self.buffer_event.wait(self.timeout)
+        # clear the event before reading so that data added after this are signalled again
+        self.buffer_event.clear()
         try:
-            return bytes(self.buffer.get(timeout=self.timeout), ENCODING)
-        except Empty:
+            return bytes(self.buffer.popleft(), ENCODING)
+        except IndexError:
             return b""
 
     def scope(self):
-        from .serial import encode_prfstate
+        if self._scope is None:
 
-        def _prf_random_states(*pos, on_prob=0.5):
-            prf = self.generate_prfstate(*pos, on_prob=on_prob)
-            return "PRFSTATE " + encode_prfstate(prf, self.prfstate_bits)
+            def _random(a, b, _rand=random.random, _round=round):
+                return a + _round(_rand() * b)
 
-        return Map(
-            random=lambda a, b: a + round(random.random() * b),
-            prf_random_states=_prf_random_states,
-        )
+            self._scope = Map(
+                random=_random,
+                prf_random_states=self.prf_random_states,
+            )
+        return self._scope
 
     def worker(self, exit_event):
         _scope = self.scope()
 
-        def _value(v):
-            if isinstance(v, PythonExpression):
-                return v.eval(_scope)
-            else:
-                return v
+        # rules ordered by the time of their next write
+        schedule = []
+        for i, rule in enumerate(self._rule_states):
+            schedule.append((time.time() + rule.time_next_value(_scope), i, rule))
+        heapq.heapify(schedule)
 
         try:
             while not exit_event.is_set():
-                current_time = time.time()
-                for rule in self.rules:
-                    if rule.get("time_next"):
-                        if rule.__last_write is None:
-                            rule.__last_write = current_time
-                        if current_time - rule.__last_write > _value(rule.time_next):
-                            self.buffer.put(_value(rule.write))
-                            rule.__last_write = current_time
-                exit_event.wait(0.5)
+                if not schedule:
+                    exit_event.wait()
+                    continue
+                next_time, i, rule = schedule[0]
+                if exit_event.wait(max(0, next_time - time.time())):
+                    break
+                self._enqueue(rule.write_value(_scope))
+                rule.last_write = time.time()
+                next_time = rule.last_write + rule.time_next_value(_scope)
+                heapq.heapreplace(schedule, (next_time, i, rule))
         finally:
             self.log.info("Simulator worker ended.")
 
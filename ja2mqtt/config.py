@@ -3,13 +3,16 @@
 
 from __future__ import absolute_import, unicode_literals
 
+import hashlib
 import io
 import json
 import logging
 import logging.config
 import os
+import pickle
 import re
 import sys
+import tempfile
 import warnings
 from threading import Event
 
@@ -28,6 +31,7 @@ warnings.filterwarnings("ignore", category=DeprecationWarning)
 import imp
 from functools import reduce
 
+from . import __version__
 from .utils import (
     Map,
     PythonExpression,
@@ -50,8 +54,15 @@ DEBUG = str2bool(os.getenv("JA2MQTT_DEBUG", "False"))
 ANSI_COLORS = not str2bool(os.getenv("JA2MQTT_NO_ANSI", "False"))
 CONFIG_FILE = os.getenv("JA2MQTT_CONFIG", None)
 CONFIG_ENV = os.getenv("JA2MQTT_ENV", None)
+CACHE_DIR = os.getenv("JA2MQTT_CACHE_DIR", os.path.expanduser("~/.cache/ja2mqtt"))
 
-env_variables = ["JA2MQTT_DEBUG", "JA2MQTT_NO_ANSI", "JA2MQTT_CONFIG", "JA2MQTT_ENV"]
+env_variables = [
+    "JA2MQTT_DEBUG",
+    "JA2MQTT_NO_ANSI",
+    "JA2MQTT_CONFIG",
+    "JA2MQTT_ENV",
+    "JA2MQTT_CACHE_DIR",
+]
 
 ENCODING = "ascii"
 
@@ -63,9 +74,15 @@ SCHEMA_VERSIONS = ["1.0"]
 
 
 class Jinja2TemplateLoader(jinja2.BaseLoader):
+    def __init__(self):
+        # paths of all templates loaded, including the included and imported ones
+        self.sources = []
+
     def get_source(self, environment, template):
         if not os.path.exists(template):
             raise jinja2.TemplateNotFound(template)
+        if template not in self.sources:
+            self.sources.append(template)
         with open(template, "r", encoding="utf-8") as f:
             source = f.read()
         return source, template, lambda: True
@@ -83,9 +100,9 @@ class Jinja2Template(io.BytesIO):
     def __init__(self, file, scope=None, strip_blank_lines=False):
         super(Jinja2Template, self).__init__(None)
         self.name = file
-        env = jinja2.Environment(
-            loader=Jinja2TemplateLoader(), trim_blocks=True, lstrip_blocks=True
-        )
+        loader = Jinja2TemplateLoader()
+        self.sources = loader.sources
+        env = jinja2.Environment(loader=loader, trim_blocks=True, lstrip_blocks=True)
         if scope is not None:
             env.globals.update(scope)
         try:
@@ -145,7 +162,11 @@ def init_env(env_file, sep="=", comment="#"):
     return env
 
 
-def read_config(config_file, env_file, use_template, scope=None):
+def read_config(config_file, env_file, use_template, scope=None, sources=None):
+    """
+    Read and parse the configuration file. When `sources` is a list, it is extended
+    with paths of all files the configuration was read from.
+    """
     if not (os.path.exists(config_file)):
         raise Exception(f"The configuration file {config_file} does not exist!")
     if env_file and not (os.path.exists(env_file)):
@@ -172,10 +193,92 @@ def read_config(config_file, env_file, use_template, scope=None):
         )
     finally:
         stream.close()
+    if sources is not None:
+        sources.extend(stream.sources if use_template else [config_file])
     config_dir = os.path.dirname(config_file)
     return config, config_file, config_dir
 
 
+def files_state(files):
+    """
+    Return the state of the files as a list of their paths, modification times and sizes
+    followed by the values of environment variables used in the files.
+    """
+    state = []
+    env_names = set()
+    for f in files:
+        st = os.stat(f)
+        state.append((f, st.st_mtime_ns, st.st_size))
+        with open(f, "r", encoding="utf-8") as fs:
+            env_names.update(x[2:-1] for x in re.findall(ENVPARAM_PATTERN, fs.read()))
+    return state + [(k, os.getenv(k)) for k in sorted(env_names)]
+
+
+def is_private(path):
+    """
+    Return True if the path is owned by the current user and others cannot write to it.
+    """
+    if not hasattr(os, "getuid"):
+        return True
+    st = os.stat(path)
+    return st.st_uid == os.getuid() and not st.st_mode & 0o022
+
+
+def read_config_cached(config_file, env_file, use_template, scope=None, depends=None):
+    """
+    Read the configuration the same way as `read_config` and cache the parsed
+    configuration in `CACHE_DIR`. The cache is invalidated when the configuration file,
+    the env file, any of the files in `depends`, any of the templates included or
+    imported by the configuration file or values of environment variables used in
+    these files change. Only the parsed data are cached, the `scope` is used only when
+    the cache is not valid. The cache is disabled when `CACHE_DIR` is empty and it is
+    only read when the cache directory and the cache file are private to the user.
+    """
+    global ENV
+    if not CACHE_DIR:
+        return read_config(config_file, env_file, use_template, scope)
+
+    files = [
+        os.path.realpath(x) for x in [config_file, env_file] + list(depends or []) if x
+    ]
+    try:
+        key = [__version__, use_template] + files_state(files)
+        cache_file = os.path.join(
+            CACHE_DIR, hashlib.sha1(files[0].encode("utf-8")).hexdigest() + ".pkl"
+        )
+    except Exception:
+        return read_config(config_file, env_file, use_template, scope)
+
+    try:
+        if is_private(CACHE_DIR) and is_private(cache_file):
+            with open(cache_file, "rb") as f:
+                cached = pickle.load(f)
+            if cached["key"] == key and cached["sources_state"] == files_state(
+                cached["sources"]
+            ):
+                ENV = init_env(env_file)
+                return cached["config"], files[0], os.path.dirname(files[0])
+    except Exception:
+        pass
+
+    sources = []
+    config, config_file, config_dir = read_config(
+        config_file, env_file, use_template, scope, sources=sources
+    )
+    try:
+        cached = dict(
+            key=key, sources=sources, sources_state=files_state(sources), config=config
+        )
+        os.makedirs(CACHE_DIR, mode=0o700, exist_ok=True)
+        if is_private(CACHE_DIR):
+            with tempfile.NamedTemporaryFile(dir=CACHE_DIR, delete=False) as f:
+                pickle.dump(cached, f)
+            os.replace(f.name, cache_file)
+    except Exception:
+        pass
+    return config, config_file, config_dir
+
+
 def replace_env_variable(value):
     """
     Replace all environment varaibles in a string privided in `value` parameter
@@ -228,17 +331,27 @@ class Config:
         log_level="INFO",
         scope=None,
         use_template=False,
+        cache_depends=None,
     ):
         """
         Read and parse the configuration from the yaml file and initializes the logging.
+        When `cache_depends` is a list of files the configuration depends on (such as
+        the main configuration providing the template scope), the parsed configuration
+        is cached.
         """
         self.schema = None
         self.log_level = log_level
+        self.env_file = env
         if not (os.path.exists(file)):
             raise Exception(f"The configuration file {file} does not exist!")
-        self.raw_config, self.config_file, self.config_dir = read_config(
-            file, env, use_template=use_template, scope=scope
-        )
+        if cache_depends is not None:
+            self.raw_config, self.config_file, self.config_dir = read_config_cached(
+                file, env, use_template=use_template, scope=scope, depends=cache_depends
+            )
+        else:
+            self.raw_config, self.config_file, self.config_dir = read_config(
+                file, env, use_template=use_template, scope=scope
+            )
         self.root = self.get_part(None)
         if schema:
             self.schema = read_config(
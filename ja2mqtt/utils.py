@@ -3,6 +3,7 @@
 
 from __future__ import absolute_import, unicode_literals
 
+import builtins
 import random
 import re
 import string
@@ -11,6 +12,11 @@ import time
 from functools import reduce
 import json
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 
 class bcolors:
     HEADER = "\033[95m"
@@ -34,6 +40,48 @@ def format_str_color(str, color, disable=False):
     )
 
 
+# numbers with 20 or more digits may not fit to 64 bits that orjson parses as integers
+LONG_NUMBER_RE = re.compile(r"[0-9]{20}")
+LONG_NUMBER_RE_BYTES = re.compile(rb"[0-9]{20}")
+
+
+def json_loads(data):
+    """
+    Parse JSON data from a string or bytes. It uses `orjson` when it is installed
+    and falls back to the standard `json` module otherwise. The `json` module is also
+    used for data `orjson` rejects (such as `NaN` or `Infinity`) and for data with
+    long numbers, as `orjson` parses integers over 64 bits as floats.
+    """
+    if orjson is not None:
+        long_number_re = LONG_NUMBER_RE if isinstance(data, str) else LONG_NUMBER_RE_BYTES
+        if not long_number_re.search(data):
+            try:
+                return orjson.loads(data)
+            except orjson.JSONDecodeError:
+                pass
+    return json.loads(data)
+
+
+def json_dumps(obj):
+    """
+    Serialize the object to a JSON string. It uses `orjson` when it is installed
+    and falls back to the standard `json` module otherwise.
+    """
+    if orjson is not None:
+        # non-string keys are converted to strings as json.dumps does, data orjson
+        # cannot serialize (e.g. integers over 64 bits) are left to json.dumps
+        try:
+            return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS).decode("utf-8")
+        except TypeError:
+            pass
+    return json.dumps(obj)
+
+
+# globals shared by all python expressions, the expressions only read them and
+# evaluate against the provided scope, so the dict does not need to be rebuilt per call
+EVAL_GLOBALS = {"__builtins__": builtins}
+
+
 class PythonExpression:
     def __init__(self, expr):
         self.expr_str = expr
@@ -43,7 +91,7 @@ class PythonExpression:
         return compile(self.expr_str, "<string>", "eval")
 
     def eval(self, scope):
-        return eval(self.expr, {}, scope)
+        return eval(self.expr, EVAL_GLOBALS, scope)
 
     def __getstate__(self):
         return (self.expr_str, None)
@@ -144,6 +192,17 @@ def deep_eval(data, scope, raise_ex=False):
     return data
 
 
+def deep_has_eval(data):
+    """
+    Return True if the data contain a value that `deep_eval` would evaluate.
+    """
+    if isinstance(data, dict):
+        return any(deep_has_eval(x) for x in data.values())
+    elif isinstance(data, list):
+        return any(deep_has_eval(x) for x in data)
+    return callable(getattr(data, "eval", None))
+
+
 def deep_find(dic, keys, default=None, type=None, delim="."):
     val = reduce(
         lambda di, key: di.get(key, default) if isinstance(di, dict) else default,